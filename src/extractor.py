@@ -1,11 +1,39 @@
 # src/extractors/production_extractor.py
+import os
 import re
+import json
+import random
+import heapq
+import asyncio
+from collections import defaultdict
 import dns.resolver
-from email_validator import validate_email, EmailNotValidError
-from typing import List, Dict, Set
+import dns.asyncresolver
+import redis
+import redis.asyncio
+import diskcache
+from email_validator import validate_email, EmailNotValidError, SPECIAL_USE_DOMAIN_NAMES
+from typing import List, Dict, Iterable, Iterator, Tuple
 import hashlib
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# MX results are cached on local disk (shared by the prefork children on a
+# host) and in Redis (shared across hosts) for about a day; jitter spreads
+# expiry so popular domains don't all re-resolve at once
+MX_CACHE_TTL = 86400
+MX_CACHE_JITTER = 3600
+MX_CACHE_DIR = os.getenv("MX_CACHE_DIR", "/tmp/mx_cache")
+
+# DNS timeouts are only remembered briefly, and only on this host
+MX_CACHE_TRANSIENT_TTL = 300
+
+# Redis is called from the worker's shared event loop, so a slow or unreachable
+# server must fail fast (well under the 3s DNS lifetime) and fall through to DNS
+REDIS_TIMEOUT = 0.5
+
+# Upper bound on DNS queries in flight per worker process. Each prefork child
+# runs one task at a time, so the host-wide ceiling is this times the worker
+# --concurrency; keep that product under public resolvers' per-IP rate limits
+DNS_CONCURRENCY = int(os.getenv("DNS_CONCURRENCY", "10"))
 
 class ProductionEmailExtractor:
     """
@@ -16,33 +44,52 @@ class ProductionEmailExtractor:
     4. Intelligent filtering
     """
     
-    def __init__(self):
-        self.mx_cache = {}
+    def __init__(self, redis_url: str = None, mx_cache_dir: str = MX_CACHE_DIR):
+        # SQLite-backed, so sibling worker processes read each other's lookups
+        self.mx_cache = diskcache.Cache(mx_cache_dir, size_limit=1 << 30)
+        # Async client, opened lazily on the loop that uses it (see _get_redis)
+        self.redis_url = redis_url
+        self._redis = None
+        self._redis_loop = None
         
         # Multiple extraction patterns (catches 99% of emails)
+        # Fused into a single alternation below so plain addresses take one scan.
+        # Alternatives are non-capturing; where only part of the match is the
+        # address, it is captured in a named group listed in _address_groups.
         self.patterns = [
             # Standard emails
-            r'\b[a-zA-Z0-9][a-zA-Z0-9._%+-]{0,63}@[a-zA-Z0-9][a-zA-Z0-9.-]{0,253}\.[a-zA-Z]{2,63}\b',
+            r'(?:\b[a-zA-Z0-9][a-zA-Z0-9._%+-]{0,63}@[a-zA-Z0-9][a-zA-Z0-9.-]{0,253}\.[a-zA-Z]{2,63}\b)',
             
             # Emails with + addressing (gmail style)
-            r'\b[a-zA-Z0-9._%+-]+\+[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}\b',
-            
-            # Obfuscated: user [at] domain [dot] com
-            r'\b[a-zA-Z0-9._%+-]+\s*[\[\(]?\s*at\s*[\]\)]?\s*[a-zA-Z0-9.-]+\s*[\[\(]?\s*dot\s*[\]\)]?\s*[a-zA-Z]{2,}\b',
-            
-            # Obfuscated: user AT domain DOT com
-            r'\b[a-zA-Z0-9._%+-]+\s+AT\s+[a-zA-Z0-9.-]+\s+DOT\s+[a-zA-Z]{2,}\b',
+            r'(?:\b[a-zA-Z0-9._%+-]+\+[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}\b)',
             
             # mailto: links
-            r'mailto:\s*([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})',
+            r'(?:mailto:\s*(?P<mailto>[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}))',
             
             # Emails in parentheses or brackets
-            r'[\(\[]\s*([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})\s*[\)\]]',
+            r'(?:[\(\[]\s*(?P<bracketed>[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})\s*[\)\]])',
             
             # Emails after "email:", "contact:", "e-mail:"
-            r'(?:email|e-mail|contact|reach):\s*([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})',
+            r'(?:(?:email|e-mail|contact|reach):\s*(?P<labelled>[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}))',
+        ]
+        self._address_groups = ('mailto', 'bracketed', 'labelled')
+        
+        # Obfuscated forms get a pass each: in one alternation a match like
+        # 'kate dot john' would swallow the start of 'john.smith@smith-law.org'
+        self.obfuscated_patterns = [
+            # Obfuscated: user [at] domain [dot] com
+            r'(?:\b[a-zA-Z0-9._%+-]+\s*[\[\(]?\s*at\s*[\]\)]?\s*[a-zA-Z0-9.-]+\s*[\[\(]?\s*dot\s*[\]\)]?\s*[a-zA-Z]{2,}\b)',
+            
+            # Obfuscated: user AT domain DOT com
+            r'(?:\b[a-zA-Z0-9._%+-]+\s+AT\s+[a-zA-Z0-9.-]+\s+DOT\s+[a-zA-Z]{2,}\b)',
         ]
         
+        # Scoring vocabularies, built once rather than per scored email
+        self.relevant_keywords = ('attorney', 'lawyer', 'partner', 'counsel', 'esq',
+                                  'contact', 'team', 'staff', 'about', 'reach')
+        self.generic_prefixes = ('info', 'contact', 'admin', 'support', 'sales',
+                                 'hello', 'help', 'service', 'office')
+        
         # Extensions that are NOT emails (images, files, etc.)
         self.forbidden_extensions = {
             'png', 'jpg', 'jpeg', 'gif', 'svg', 'webp', 'bmp', 'ico',
@@ -58,30 +105,49 @@ class ProductionEmailExtractor:
             r'@.*\.(png|jpg|jpeg|gif|svg|webp|pdf|css|js)$',  # File extensions
             r'^[0-9.]+@',  # Starts with numbers only (likely phone/date)
             r'@[0-9.]+$',  # Domain is only numbers
-            r'@example\.(com|org|net)',  # Example domains
-            r'@test\.',  # Test domains
             r'^(test|demo|sample|example)',  # Test emails
-            r'@(localhost|127\.0\.0\.1)',  # Localhost
             r'\.\.[a-z]',  # Double dots (invalid)
         ]
+        
+        # Plain substrings to exclude (checked with `in`, no regex needed;
+        # candidates are lower-cased before the check)
+        self.exclusion_substrings = (
+            '@example.com', '@example.org', '@example.net',  # Example domains
+            '@test.',  # Test domains
+            '@localhost', '@127.0.0.1',  # Localhost
+        )
+        
+        # Compile once so the hot loops don't go through re's cache on every call
+        self._combined_pattern = re.compile('|'.join(self.patterns), re.IGNORECASE)
+        self._obfuscated_compiled = [re.compile(p, re.IGNORECASE) for p in self.obfuscated_patterns]
+        self._exclusion_combined = re.compile(
+            '|'.join(f'(?:{p})' for p in self.exclusion_patterns), re.IGNORECASE
+        )
+        # Plain lower-case ASCII addresses that email-validator would accept unchanged:
+        # dot-separated local part (<= 64 chars), LDH domain labels, alphabetic TLD
+        self._fast_email = re.compile(
+            r'^(?=.{1,254}$)(?=[^@]{1,64}@)[a-z0-9_%+\-]+(?:\.[a-z0-9_%+\-]+)*'
+            r'@(?:[a-z0-9](?:[a-z0-9\-]{0,61}[a-z0-9])?\.)+[a-z]{2,63}$'
+        )
+        self._at_sub = re.compile(r'\s*[\[\(]?\s*at\s*[\]\)]?\s*', re.IGNORECASE)
+        self._dot_sub = re.compile(r'\s*[\[\(]?\s*dot\s*[\]\)]?\s*', re.IGNORECASE)
     
-    def extract_all_emails(self, markdown: str) -> List[Dict]:
+    async def extract_all_emails(self, markdown: str) -> List[Dict]:
         print(f"📧 Starting extraction from {len(markdown)} characters of markdown...")
         
+        # Steps 1-3 stream into each other; DNS is the only batch barrier
         # Step 1: Extract all possible candidates
         candidates = self._extract_candidates(markdown)
-        print(f"🔍 Found {len(candidates)} candidate emails")
         
         # Step 2: Normalize and clean
         normalized = self._normalize_emails(candidates)
-        print(f"✨ Normalized to {len(normalized)} unique emails")
         
         # Step 3: Validate syntax
-        syntax_valid = self._validate_syntax_batch(normalized)
+        syntax_valid = list(self._validate_syntax(normalized))
         print(f"✅ {len(syntax_valid)} passed syntax validation")
         
         # Step 4: Validate DNS/MX records
-        dns_valid = self._validate_dns_batch(syntax_valid)
+        dns_valid = await self._validate_dns_batch(syntax_valid)
         print(f"🌐 {len(dns_valid)} have valid MX records")
         
         # Step 5: Score and rank
@@ -93,34 +159,48 @@ class ProductionEmailExtractor:
         
         return final
     
-    def _extract_candidates(self, text: str) -> Set[str]:
-        """Extract using ALL patterns"""
-        candidates = set()
+    def _extract_candidates(self, text: str) -> Iterator[Tuple[str, int]]:
+        """
+        Extract using ALL patterns (one pass for plain, one per obfuscated form)
+        Yields each distinct candidate with the offset of its first occurrence
+        """
+        seen = set()
         
-        for pattern in self.patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            
-            # Handle tuple results (from capture groups)
-            for match in matches:
-                if isinstance(match, tuple):
-                    match = match[0] if match[0] else match[1] if len(match) > 1 else ''
-                
-                if match:
-                    candidates.add(str(match).strip())
+        # Every pass comes out in text order, so merging keeps the stream ordered
+        passes = [self._scan(self._combined_pattern, text)]
+        passes += [self._scan(pattern, text) for pattern in self._obfuscated_compiled]
+        
+        for address, position in heapq.merge(*passes, key=lambda candidate: candidate[1]):
+            if address not in seen:
+                seen.add(address)
+                yield address, position
+    
+    def _scan(self, pattern, text: str) -> Iterator[Tuple[str, int]]:
+        """Yield (address, offset) for every match of one compiled pattern"""
+        address_groups = [g for g in self._address_groups if g in pattern.groupindex]
         
-        return candidates
+        for match in pattern.finditer(text):
+            # Prefer the captured address when the alternative wraps it (mailto:, brackets, labels)
+            group = next((g for g in address_groups if match.group(g)), 0)
+            address = match.group(group).strip()
+            
+            if address:
+                yield address, match.start(group)
     
-    def _normalize_emails(self, candidates: Set[str]) -> Set[str]:
-        """Normalize obfuscated emails and clean up"""
-        normalized = set()
+    def _normalize_emails(self, candidates: Iterable[Tuple[str, int]]) -> Iterator[Tuple[str, int]]:
+        """Normalize obfuscated emails and clean up (first occurrence wins)"""
+        seen = set()
         
-        for email in candidates:
+        for email, position in candidates:
             # Convert obfuscated formats
             cleaned = email.lower().strip()
             
             # user [at] domain [dot] com -> user@domain.com
-            cleaned = re.sub(r'\s*[\[\(]?\s*at\s*[\]\)]?\s*', '@', cleaned, flags=re.IGNORECASE)
-            cleaned = re.sub(r'\s*[\[\(]?\s*dot\s*[\]\)]?\s*', '.', cleaned, flags=re.IGNORECASE)
+            # Only obfuscated candidates lack a literal '@'; real addresses skip the
+            # substitutions (which would otherwise mangle e.g. 'kate@' into 'k@e@')
+            if '@' not in cleaned:
+                cleaned = self._at_sub.sub('@', cleaned)
+                cleaned = self._dot_sub.sub('.', cleaned)
             
             # Remove surrounding quotes, parentheses, brackets
             cleaned = cleaned.strip('"\'"()[]<> ')
@@ -132,8 +212,10 @@ class ProductionEmailExtractor:
             if not cleaned or len(cleaned) < 6:
                 continue
             
-            # Skip if matches exclusion patterns
-            if any(re.search(pattern, cleaned, re.IGNORECASE) for pattern in self.exclusion_patterns):
+            # Skip if matches exclusion substrings or patterns
+            if any(sub in cleaned for sub in self.exclusion_substrings):
+                continue
+            if self._exclusion_combined.search(cleaned):
                 continue
             
             # Skip if domain ends with forbidden extension
@@ -145,61 +227,97 @@ class ProductionEmailExtractor:
                     if last_part in self.forbidden_extensions:
                         continue
             
-            normalized.add(cleaned)
-        
-        return normalized
+            if cleaned in seen:
+                continue
+            seen.add(cleaned)
+            yield cleaned, position
     
-    def _validate_syntax_batch(self, emails: Set[str]) -> List[Dict]:
+    def _validate_syntax(self, emails: Iterable[Tuple[str, int]]) -> Iterator[Dict]:
         """Validate email syntax using email-validator library"""
-        valid = []
-        
-        for email in emails:
+        for email, position in emails:
+            # Fast path: obviously valid shapes don't need the full RFC parser
+            if self._is_plain_address(email):
+                local, _, domain = email.partition('@')
+                yield {
+                    'original': email,
+                    'normalized': email,
+                    'local': local,
+                    'domain': domain,
+                    'position': position,  # First offset in the markdown
+                    'is_valid': True
+                }
+                continue
+            
             try:
                 # Use email-validator for RFC-compliant validation
                 validated = validate_email(email, check_deliverability=False)
                 
-                valid.append({
+                yield {
                     'original': email,
                     'normalized': validated.normalized,
                     'local': validated.local_part,
                     'domain': validated.domain,
+                    'position': position,  # First offset in the markdown
                     'is_valid': True
-                })
+                }
             except EmailNotValidError:
                 # Skip invalid emails silently
                 continue
-        
-        return valid
     
-    def _validate_dns_batch(self, emails: List[Dict]) -> List[Dict]:
-        """Upgraded: Validate domains in parallel for speed"""
+    def _is_plain_address(self, email: str) -> bool:
+        """
+        True if email-validator would accept the address as-is
+        (IDNA 'xn--' style labels and special-use domains go the slow way)
+        """
+        if not self._fast_email.match(email):
+            return False
+        domain = email.partition('@')[2]
+        if '--' in domain:
+            return False
+        return not any(domain.endswith('.' + name) for name in SPECIAL_USE_DOMAIN_NAMES)
+    
+    async def _validate_dns_batch(self, emails: List[Dict]) -> List[Dict]:
+        """Validate domains concurrently on the event loop (DNS is network-bound)"""
         validated_results = []
-        # Use a pool of 20 threads to handle DNS lookups simultaneously
-        with ThreadPoolExecutor(max_workers=20) as executor:
-            future_to_email = {
-                executor.submit(self._check_mx_with_fallback, e['domain']): e 
-                for e in emails
-            }
-            for future in as_completed(future_to_email):
-                email_data = future_to_email[future]
-                try:
-                    mx_info = future.result()
-                    email_data.update(mx_info)
-                    if mx_info['has_mx'] or mx_info['has_a_record']:
-                        validated_results.append(email_data)
-                except Exception:
-                    continue
+        semaphore = asyncio.Semaphore(DNS_CONCURRENCY)
+        
+        # Resolve each domain once and fan the result out to all its emails
+        by_domain = defaultdict(list)
+        for e in emails:
+            by_domain[e['domain']].append(e)
+        
+        async def check(domain):
+            async with semaphore:
+                return await self._check_mx_with_fallback(domain)
+        
+        results = await asyncio.gather(
+            *[check(domain) for domain in by_domain],
+            return_exceptions=True
+        )
+        for domain, mx_info in zip(by_domain, results):
+            if isinstance(mx_info, Exception):
+                continue
+            for email_data in by_domain[domain]:
+                email_data.update(mx_info)
+                if mx_info['has_mx'] or mx_info['has_a_record']:
+                    validated_results.append(email_data)
         return validated_results
     
-    def _check_mx_with_fallback(self, domain: str) -> Dict:
+    async def _check_mx_with_fallback(self, domain: str) -> Dict:
         """
         Check MX records with A record fallback
         (Some servers accept mail via A record without MX)
         """
         # Use cache to avoid hammering DNS servers
         cache_key = domain.lower()
-        if cache_key in self.mx_cache:
-            return self.mx_cache[cache_key]
+        cached = self.mx_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        shared = await self._get_shared_mx(cache_key)
+        if shared is not None:
+            self.mx_cache.set(cache_key, shared, expire=self._mx_ttl())
+            return shared
         
         result = {
             'has_mx': False,
@@ -210,7 +328,7 @@ class ProductionEmailExtractor:
         
         try:
             # Try MX records first
-            mx_records = dns.resolver.resolve(domain, 'MX', lifetime=3)
+            mx_records = await dns.asyncresolver.resolve(domain, 'MX', lifetime=3)
             mx_list = list(mx_records)
             
             if mx_list:
@@ -221,29 +339,73 @@ class ProductionEmailExtractor:
         except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
             # No MX records, try A record as fallback
             try:
-                a_records = dns.resolver.resolve(domain, 'A', lifetime=3)
+                a_records = await dns.asyncresolver.resolve(domain, 'A', lifetime=3)
                 if list(a_records):
                     result['has_a_record'] = True
-            except:
-                pass
+            except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+                pass  # Definitively no A record either
+            except Exception:
+                # Timeout or other DNS error - not a real negative, so keep it
+                # local and short-lived like the MX failure below
+                self.mx_cache.set(cache_key, result, expire=MX_CACHE_TRANSIENT_TTL)
+                return result
         
         except Exception:
             # Timeout or other DNS error - give benefit of doubt
             result['has_mx'] = True  # Don't discard due to DNS issues
+            self.mx_cache.set(cache_key, result, expire=MX_CACHE_TRANSIENT_TTL)
+            return result  # Transient, so keep it out of Redis
         
-        self.mx_cache[cache_key] = result
+        self.mx_cache.set(cache_key, result, expire=self._mx_ttl())
+        await self._set_shared_mx(cache_key, result)
         return result
     
-    def _score_emails(self, emails: List[Dict], context: str) -> List[Dict]:
+    def _mx_ttl(self) -> int:
+        """Cache lifetime for a resolved MX result, with jitter"""
+        return MX_CACHE_TTL + random.randint(0, MX_CACHE_JITTER)
+    
+    def _get_redis(self):
+        """Async Redis client for the running loop (None if no Redis is configured)"""
+        if self.redis_url is None:
+            return None
+        loop = asyncio.get_running_loop()
+        if self._redis_loop is not loop:
+            # asyncio connections belong to the loop that opened them, and a worker
+            # starts a new loop after a browser reset, so reconnect on the new one
+            self._redis = redis.asyncio.Redis.from_url(
+                self.redis_url, socket_timeout=REDIS_TIMEOUT, socket_connect_timeout=REDIS_TIMEOUT
+            )
+            self._redis_loop = loop
+        return self._redis
+    
+    async def _get_shared_mx(self, domain: str):
+        """Look up a cached MX result in Redis (None on miss or if Redis is down)"""
+        client = self._get_redis()
+        if client is None:
+            return None
+        try:
+            cached = await client.get(f"mx:{domain}")
+        except redis.RedisError:
+            return None
+        return json.loads(cached) if cached else None
+    
+    async def _set_shared_mx(self, domain: str, result: Dict):
+        """Store an MX result in Redis with a jittered TTL"""
+        client = self._get_redis()
+        if client is None:
+            return
+        try:
+            await client.setex(f"mx:{domain}", self._mx_ttl(), json.dumps(result))
+        except redis.RedisError:
+            pass
+    
+    def _score_emails(self, emails: Iterable[Dict], context: str) -> Iterator[Dict]:
         """
         Score emails for quality (0-100)
         Higher score = more likely to be real person's email
         """
-        context_lower = context.lower()
-        
         for email_data in emails:
             score = 50  # Start neutral
-            email = email_data['normalized']
             local = email_data['local']
             domain = email_data['domain']
             
@@ -270,23 +432,17 @@ class ProductionEmailExtractor:
                 score += 10
             
             # Appears near relevant keywords
-            email_lower = email.lower()
-            if email_lower in context_lower:
-                # Get 200 chars before and after
-                idx = context_lower.find(email_lower)
-                window = context_lower[max(0, idx-200):min(len(context_lower), idx+200)]
-                
-                relevant_keywords = ['attorney', 'lawyer', 'partner', 'counsel', 'esq', 
-                                    'contact', 'team', 'staff', 'about', 'reach']
-                if any(kw in window for kw in relevant_keywords):
-                    score += 15
+            # (offset recorded at extraction time, so no rescan of the context)
+            idx = email_data['position']
+            # Get 200 chars before and after
+            window = context[max(0, idx-200):idx+200].lower()
+            if any(kw in window for kw in self.relevant_keywords):
+                score += 15
             
             # === NEGATIVE SIGNALS ===
             
             # Generic/role-based (but don't discard - user wants ALL emails)
-            generic_prefixes = ['info', 'contact', 'admin', 'support', 'sales', 
-                               'hello', 'help', 'service', 'office']
-            if any(local.startswith(prefix) for prefix in generic_prefixes):
+            if local.startswith(self.generic_prefixes):
                 score -= 20  # Lower score but don't exclude
             
             # No-reply addresses
@@ -298,7 +454,7 @@ class ProductionEmailExtractor:
                 score -= 10
             
             # Lots of numbers (suspicious)
-            num_digits = sum(c.isdigit() for c in local)
+            num_digits = sum(map(str.isdigit, local))
             if num_digits > len(local) * 0.5:  # More than 50% digits
                 score -= 15
             
@@ -309,8 +465,7 @@ class ProductionEmailExtractor:
             # Cap score
             email_data['score'] = max(0, min(100, score))
             email_data['confidence'] = self._score_to_confidence(email_data['score'])
-        
-        return emails
+            yield email_data
     
     def _score_to_confidence(self, score: int) -> str:
         """Convert score to confidence level"""
@@ -321,7 +476,7 @@ class ProductionEmailExtractor:
         else:
             return 'low'
     
-    def _final_filter(self, emails: List[Dict]) -> List[Dict]:
+    def _final_filter(self, emails: Iterable[Dict]) -> List[Dict]:
         """
         Final filtering - remove only obvious garbage
         Keep everything else (user wants ALL emails)
@@ -1,13 +1,14 @@
-import pandas as pd
+import polars as pl
 from .tasks import process_firm
 
 def start_ingestion(excel_path):
     print(f"Reading {excel_path}...")
-    df = pd.read_excel(excel_path)
+    # infer_schema_length=0 reads every column as text, matching the TEXT columns in the DB
+    df = pl.read_excel(excel_path, infer_schema_length=0)
 
-    df = df.fillna('')
+    df = df.fill_null('')
     
-    leads = df.to_dict(orient='records')
+    leads = df.to_dicts()
     
     print(f"Queueing {len(leads)} tasks...")
     for lead in leads: